@@ -16,12 +16,18 @@ from __future__ import annotations
 
 import argparse
 import ast
+import json
 import os
+import re
 import sys
 import sysconfig
 import site
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain, islice
 from pathlib import Path
-from typing import Iterable, Set, Dict, List, Tuple
+from typing import Iterable, Iterator, Set, Dict, List, Optional, Sequence, Tuple
 
 try:
     # Python 3.8+
@@ -34,59 +40,290 @@ import importlib.util
 
 # --------------------------- Files & AST scanning --------------------------- #
 
-EXCLUDE_DIRS = {
+EXCLUDE_DIRS = frozenset({
     ".git", ".hg", ".svn", "__pycache__", ".mypy_cache", ".pytest_cache",
     ".tox", ".venv", "venv", "env", "build", "dist", ".idea", ".vscode"
-}
+})
 EXCLUDE_FILE_SUFFIXES = {"_pb2.py"}  # add patterns you want ignored
+_EXCLUDE_SUFFIXES = tuple(EXCLUDE_FILE_SUFFIXES)  # str.endswith takes a tuple
+PARALLEL_MIN_FILES = 50  # below this, process pool start-up costs more than it saves
+PARALLEL_CHUNKSIZE = 16
+
+# Statement fields that hold nested blocks (if/try/with/def/class/match bodies).
+# Imports are statements, so expressions never need to be visited.
+_BLOCK_FIELDS = ("body", "orelse", "finalbody", "handlers", "cases")
+
+# Regex fast path: every line mentioning the word 'import' must be one of these
+_IMPORT_WORD_RE = re.compile(rb"^.*\bimport\b.*$", re.MULTILINE)
+# No two adjacent parts may match the same whitespace, or a failing line backtracks
+# quadratically; names are stripped by item.split() in scan_simple_imports.
+_IMPORT_LINE_RE = re.compile(
+    rb"[ \t]*(?:import[ \t]+([\w.,][\w. \t,]*)|from[ \t]+([\w.]+)[ \t]+import\b[^;#]*?)"
+    rb"(?:#.*)?\r?"
+)
+# A bare CR is a line break to Python but not to the patterns above
+_BARE_CR_RE = re.compile(rb"\r(?!\n)")
+# Leading module docstring, after any blank/comment lines (e.g. package __init__.py)
+_MODULE_DOCSTRING_RE = re.compile(
+    rb"(?:[ \t]*(?:#[^\r\n]*)?\r?\n)*[ \t]*[rRuU]?(\"\"\"|''').*?\1", re.DOTALL
+)
+
+
+def find_python_files(root: str | Path) -> Iterator[str]:
+    """
+    Yield paths (as str) of all .py files under root, skipping EXCLUDE_DIRS.
+    Uses an explicit stack over os.scandir so each entry is stat'ed at most once.
+    """
+    exclude_dirs = EXCLUDE_DIRS  # local lookup in the hot loop
+    stack = [str(root)]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            it = os.scandir(dirpath)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                name = entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    # prune excluded directories before descending
+                    if name not in exclude_dirs:
+                        stack.append(entry.path)
+                elif name.endswith(".py") and not name.endswith(_EXCLUDE_SUFFIXES):
+                    yield entry.path
+
+
+def import_line_modules(line: bytes) -> Optional[List[str]]:
+    """
+    Top-level modules named by one plain import line, or None if it isn't one.
+    """
+    m = _IMPORT_LINE_RE.fullmatch(line)
+    if m is None:
+        return None
+    names, module = m.groups()
+    if module is not None:
+        # Skip relative imports; they refer to local code
+        return [] if module.startswith(b".") else [module.split(b".")[0].decode("ascii")]
+    mods: List[str] = []
+    for item in names.split(b","):
+        parts = item.split()
+        if len(parts) not in (1, 3) or (len(parts) == 3 and parts[1] != b"as"):
+            return None
+        name = parts[0].split(b".")[0]
+        if not name:
+            return None
+        mods.append(name.decode("ascii"))
+    return mods
 
 
-def find_python_files(root: Path) -> List[Path]:
-    files: List[Path] = []
-    for dirpath, dirnames, filenames in os.walk(root):
-        # prune excluded directories in-place for speed
-        dirnames[:] = [d for d in dirnames if d not in EXCLUDE_DIRS]
-        for fn in filenames:
-            if fn.endswith(".py") and not any(fn.endswith(suf) for suf in EXCLUDE_FILE_SUFFIXES):
-                files.append(Path(dirpath) / fn)
-    return files
+def scan_simple_imports(data: bytes, strict: bool = True) -> Optional[Set[str]]:
+    """
+    Collect top-level imports with a line regex instead of the parser.
+    Returns None when the file isn't simple enough to be sure: bare CR line
+    endings, triple-quoted strings other than a leading module docstring,
+    backslash continuations, or any 'import' outside a plain one-line import
+    statement. Callers then fall back to ast.
+    With strict=False (for files ast can't parse) those checks are skipped:
+    every plain one-line import outside the leading docstring is returned.
+    """
+    if _BARE_CR_RE.search(data):
+        if strict:
+            return None
+        data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    # Re-export shims usually open with a docstring; drop it so they still qualify.
+    # If the match ends early, the real closing quotes remain and we bail below.
+    doc = _MODULE_DOCSTRING_RE.match(data)
+    if doc is not None:
+        data = data[doc.end():]
+    if strict and (b'"""' in data or b"'''" in data or b"\\\n" in data or b"\\\r\n" in data):
+        return None
+    mods: Set[str] = set()
+    for line in _IMPORT_WORD_RE.finditer(data):
+        found = import_line_modules(line.group())
+        if found is None:
+            if strict:
+                return None
+            continue
+        mods.update(found)
+    return mods
 
 
-def extract_top_level_imports(py_file: Path) -> Set[str]:
+def extract_top_level_imports(py_file: str) -> Set[str]:
     """
     Return the set of *top-level* module names imported in the given file.
     - 'import a.b.c' -> 'a'
     - 'from x.y import z' -> 'x'
     - relative imports ('from . import x', 'from .pkg import y') are treated as local
     """
-    src = py_file.read_text(encoding="utf-8", errors="ignore")
-    try:
-        tree = ast.parse(src, filename=str(py_file))
-    except SyntaxError:
+    with open(py_file, "rb") as fh:
+        data = fh.read()
+    # Cheap substring test first: no "import" anywhere means nothing to parse
+    if b"import" not in data:
         return set()
-
-    mods: Set[str] = set()
-    for node in ast.walk(tree):
-        if isinstance(node, ast.Import):
+    mods = scan_simple_imports(data)
+    if mods is not None:
+        return mods
+    try:
+        # Compile the bytes directly; the parser honours PEP 263 encoding cookies
+        tree = compile(data, py_file, "exec", flags=ast.PyCF_ONLY_AST, dont_inherit=True)
+    except (SyntaxError, ValueError):
+        # Undecodable bytes also raise SyntaxError; retry leniently before giving up
+        try:
+            tree = ast.parse(data.decode("utf-8", "ignore"), filename=py_file)
+        except (SyntaxError, ValueError):
+            # Invalid code (e.g. Python 2): report its plain import lines, exactly
+            # as the fast path would have, so results don't depend on which ran
+            return scan_simple_imports(data, strict=False)
+
+    mods = set()
+    # Bind hot names to locals; the loop runs once per statement in the file
+    Import, ImportFrom = ast.Import, ast.ImportFrom
+    block_fields = _BLOCK_FIELDS
+    add = mods.add
+    stack: List[ast.AST] = list(tree.body)
+    pop, extend = stack.pop, stack.extend
+    while stack:
+        node = pop()
+        # AST node classes aren't subclassed, so an identity check is safe
+        t = type(node)
+        if t is Import:
             for alias in node.names:
-                name = (alias.name or "").split(".")[0]
+                name = alias.name.partition(".")[0]
                 if name:
-                    mods.add(name)
-        elif isinstance(node, ast.ImportFrom):
+                    add(name)
+        elif t is ImportFrom:
             # Skip relative imports; they refer to local code
-            if getattr(node, "level", 0):
+            if node.level:
                 continue
-            if node.module:
-                name = node.module.split(".")[0]
-                if name:
-                    mods.add(name)
+            module = node.module
+            if module:
+                add(module.partition(".")[0])
+        else:
+            for field in block_fields:
+                extend(getattr(node, field, ()))
     return mods
 
 
+# --------------------------- Import cache ---------------------------------- #
+
+CACHE_FILE = ".gen_requirements_cache"  # written under the project root
+CACHE_VERSION = 3  # bump when a change to import extraction alters results
+
+
+def load_import_cache(path: Path) -> Dict[str, list]:
+    """
+    Load {file path: [st_mtime_ns, st_size, [modules]]} saved by a previous run.
+    A missing, unreadable or outdated cache is treated as empty.
+    """
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+        return {}
+    files = data.get("files")
+    return files if isinstance(files, dict) else {}
+
+
+def save_import_cache(path: Path, entries: Dict[str, list]) -> None:
+    try:
+        path.write_text(json.dumps({"version": CACHE_VERSION, "files": entries}), encoding="utf-8")
+    except OSError:
+        pass  # caching is best-effort (e.g. read-only checkout)
+
+
+def file_stamp(path: str) -> Optional[List[int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def is_fresh_entry(hit: object, stamp: Optional[List[int]]) -> bool:
+    """
+    True if a cache entry is well-formed and its stamp matches the file's.
+    Anything else counts as a miss, so a bad cache only costs a re-parse.
+    """
+    return (stamp is not None and isinstance(hit, list) and len(hit) == 3
+            and hit[:2] == stamp and isinstance(hit[2], list)
+            and all(isinstance(m, str) for m in hit[2]))
+
+
+def parse_files(py_files: Iterable[str]) -> Iterator[Set[str]]:
+    """
+    Yield extract_top_level_imports() for each file, in order.
+    Paths are consumed lazily, so workers start parsing while the caller's
+    directory walk is still running.
+    """
+    it = iter(py_files)
+    head = list(islice(it, PARALLEL_MIN_FILES + 1))
+    if len(head) <= PARALLEL_MIN_FILES:
+        for f in head:
+            yield extract_top_level_imports(f)
+        return
+    # ast.parse holds the GIL, so parse in worker processes
+    with ProcessPoolExecutor() as ex:
+        yield from ex.map(extract_top_level_imports, chain(head, it), chunksize=PARALLEL_CHUNKSIZE)
+
+
+def collect_imports(py_files: Iterable[str],
+                    cache: Dict[str, list]) -> Tuple[Set[str], Dict[str, list], int]:
+    """
+    Union of imports across all files. Files whose mtime and size match their
+    cache entry are not re-read.
+    Returns: (imports, entries for the next cache, number of files seen)
+    """
+    all_imports: Set[str] = set()
+    entries: Dict[str, list] = {}
+    pending: deque = deque()  # (path, stamp) awaiting results, in submission order
+    seen = 0
+
+    def uncached() -> Iterator[str]:
+        nonlocal seen
+        for f in py_files:
+            seen += 1
+            stamp = file_stamp(f)
+            hit = cache.get(f)
+            if is_fresh_entry(hit, stamp):
+                all_imports.update(hit[2])
+                entries[f] = hit
+            else:
+                pending.append((f, stamp))
+                yield f
+
+    # Workers only parse; cache entries are merged here in the main process
+    for mods in parse_files(uncached()):
+        f, stamp = pending.popleft()
+        all_imports |= mods
+        if stamp is not None:
+            entries[f] = stamp + [sorted(mods)]
+    return all_imports, entries, seen
+
+
 # --------------------------- Classification helpers ------------------------ #
 
 def norm(p: str | Path) -> str:
-    return os.path.normcase(os.path.abspath(str(p)))
+    s = os.fspath(p)
+    # sysconfig/site dirs and spec origins are already absolute; skip abspath for them
+    return os.path.normcase(s if os.path.isabs(s) else os.path.abspath(s))
+
+
+@lru_cache(maxsize=None)
+def dir_matcher(dirs: Tuple[str, ...]) -> re.Pattern:
+    """
+    One compiled pattern matching any of the dirs or a path below them,
+    built once per distinct tuple of dirs.
+    """
+    sep = re.escape(os.sep)
+    return re.compile("|".join(f"{re.escape(d)}(?:{sep}|$)" for d in dirs) or "(?!)")
+
+
+def is_under(path: str, dirs: Tuple[str, ...]) -> bool:
+    """
+    True if the normalized path equals or lies below any of the normalized dirs.
+    """
+    return dir_matcher(dirs).match(path) is not None
 
 
 def get_stdlib_dir() -> str:
@@ -95,7 +332,7 @@ def get_stdlib_dir() -> str:
     return norm(stdlib) if stdlib else ""
 
 
-def get_site_package_dirs() -> List[str]:
+def get_site_package_dirs() -> Tuple[str, ...]:
     dirs = set()
     for d in site.getsitepackages() if hasattr(site, "getsitepackages") else []:
         dirs.add(norm(d))
@@ -106,31 +343,67 @@ def get_site_package_dirs() -> List[str]:
         p = sysconfig.get_paths().get(key)
         if p:
             dirs.add(norm(p))
-    return sorted(dirs)
+    return tuple(sorted(dirs))
+
+
+# Python 3.10+; on older versions every name falls through to find_spec
+STDLIB_MODULE_NAMES = frozenset(getattr(sys, "stdlib_module_names", ()))
+
+
+@lru_cache(maxsize=None)
+def find_local_modules(project_root: Path) -> frozenset:
+    """
+    Names of top-level local modules: every {name}.py and {name}/__init__.py
+    directly under project root, collected with a single directory scan.
+    """
+    names = set()
+    try:
+        it = os.scandir(project_root)
+    except OSError:
+        return frozenset()
+    with it:
+        for entry in it:
+            name = entry.name
+            if name.endswith(".py"):
+                if entry.is_file():
+                    names.add(name[:-3])
+            elif entry.is_dir() and os.path.isfile(os.path.join(entry.path, "__init__.py")):
+                names.add(name)
+    return frozenset(names)
 
 
 def is_local_module(name: str, project_root: Path) -> bool:
     """
     Treat as local if a {name}.py or {name}/__init__.py exists under project root.
     """
-    candidates = [
-        project_root / f"{name}.py",
-        project_root / name / "__init__.py",
-    ]
-    return any(c.exists() for c in candidates)
+    return name in find_local_modules(project_root)
 
 
+@lru_cache(maxsize=None)
+def find_spec(name: str):
+    """
+    Cached importlib.util.find_spec; the lookup touches the filesystem heavily.
+    """
+    return importlib.util.find_spec(name)
+
+
+@lru_cache(maxsize=None)
 def classify_module_origin(name: str, project_root: Path,
-                           stdlib_dir: str, site_dirs: List[str]) -> str:
+                           stdlib_dir: str, site_dirs: Tuple[str, ...]) -> str:
     """
     Return one of: 'stdlib', 'thirdparty', 'local', 'unknown'
     Uses importlib.util.find_spec (no import side-effects).
+    Results are memoized, so all arguments must be hashable.
     """
     # Quick local check by presence of file/package in project
     if is_local_module(name, project_root):
         return "local"
 
-    spec = importlib.util.find_spec(name)
+    # Known stdlib names need no spec lookup
+    if name in STDLIB_MODULE_NAMES:
+        return "stdlib"
+
+    spec = find_spec(name)
     if spec is None:
         return "unknown"
 
@@ -142,21 +415,21 @@ def classify_module_origin(name: str, project_root: Path,
     if spec.origin:
         origins.append(spec.origin)
     if spec.submodule_search_locations:
-        origins.extend(list(spec.submodule_search_locations))
+        origins.extend(spec.submodule_search_locations)
 
     origins = [norm(p) for p in origins if p]
 
     # Local project?
-    proj = norm(project_root)
-    if any(o.startswith(proj + os.sep) or o == proj for o in origins):
+    proj = (norm(project_root),)
+    if any(is_under(o, proj) for o in origins):
         return "local"
 
     # Stdlib?
-    if stdlib_dir and any(o.startswith(stdlib_dir + os.sep) or o == stdlib_dir for o in origins):
+    if stdlib_dir and any(is_under(o, (stdlib_dir,)) for o in origins):
         return "stdlib"
 
     # Site-packages?
-    if any(any(o.startswith(sd + os.sep) or o == sd for sd in site_dirs) for o in origins):
+    if any(is_under(o, site_dirs) for o in origins):
         return "thirdparty"
 
     return "unknown"
@@ -164,23 +437,41 @@ def classify_module_origin(name: str, project_root: Path,
 
 # --------------------------- Distribution resolution ----------------------- #
 
+def dist_name_from_path(dist) -> str:
+    """
+    Read a distribution's name from its '<name>-<version>.dist-info' folder,
+    avoiding a METADATA read. Returns '' when the folder doesn't follow that layout.
+    Folder names may be normalized (e.g. lowercased), so only use this as a lookup key.
+    """
+    path = getattr(dist, "_path", None)
+    if path is None:
+        return ""
+    folder = os.path.basename(str(path))
+    if not folder.endswith(".dist-info"):
+        return ""
+    name, _, _ = folder.partition("-")
+    return name
+
+
+@lru_cache(maxsize=1)
 def build_top_to_dists_map() -> Dict[str, List[str]]:
     """
     Map top-level import names -> list of distribution names that provide them.
     Uses packages_distributions() when available; falls back to reading top_level.txt.
+    Computed once per run; callers must not mutate the result.
     """
     # Preferred (Python 3.10+)
-    pkgs_to_dists = {}
     try:
         pkgs_to_dists = metadata.packages_distributions()  # type: ignore[attr-defined]
         if pkgs_to_dists:
-            return {k: list(v) for k, v in pkgs_to_dists.items()}
+            return pkgs_to_dists
     except Exception:
         pass
 
     # Fallback: build manually from installed distributions
     mapping: Dict[str, List[str]] = {}
     for dist in metadata.distributions():
+        # Name is emitted as-is, so take it from METADATA; folder names may be lowercased
         dist_name = dist.metadata.get("Name") or dist.metadata.get("Summary") or ""
         if not dist_name:
             continue
@@ -191,7 +482,7 @@ def build_top_to_dists_map() -> Dict[str, List[str]]:
         if not top_txt:
             # Some packages don't have top_level.txt; try to infer from files
             # (best-effort heuristic)
-            files = list(dist.files or [])
+            files = dist.files or []
             tops = {f.parts[0] for f in files if len(f.parts) >= 1 and f.suffix in {"", ".py"}}
         else:
             tops = {line.strip() for line in top_txt.splitlines() if line.strip()}
@@ -200,17 +491,33 @@ def build_top_to_dists_map() -> Dict[str, List[str]]:
     return mapping
 
 
+@lru_cache(maxsize=1)
+def build_dist_versions() -> Dict[str, str]:
+    """
+    Map PEP 503-normalized distribution names -> installed version.
+    One pass over installed distributions instead of a sys.path scan per
+    metadata.version() call. The first match on sys.path wins, as with version().
+    """
+    versions: Dict[str, str] = {}
+    for dist in metadata.distributions():
+        name = dist_name_from_path(dist) or dist.metadata.get("Name")
+        if name:
+            versions.setdefault(dist_key(name), dist.version)
+    return versions
+
+
 def resolve_requirements(modules: Iterable[str]) -> Tuple[Dict[str, str], List[str]]:
     """
     Given top-level module names that are third-party, resolve to {dist: version}.
     Returns: (requirements_dict, unresolved_modules)
     """
     top_to_dists = build_top_to_dists_map()
+    dist_versions = build_dist_versions()
     reqs: Dict[str, str] = {}
     unresolved: List[str] = []
 
     for mod in sorted(set(modules)):
-        dists = top_to_dists.get(mod)
+        dists = top_to_dists.get(mod, ())
         if not dists:
             # Not found in metadata map → try a last-resort guess by importing
             # (Still avoid import side effects; we won't import here to be safe.)
@@ -221,9 +528,8 @@ def resolve_requirements(modules: Iterable[str]) -> Tuple[Dict[str, str], List[s
         # Otherwise take the first.
         chosen = pick_best_dist_for_module(mod, dists)
 
-        try:
-            ver = metadata.version(chosen)
-        except metadata.PackageNotFoundError:
+        ver = dist_versions.get(dist_key(chosen))
+        if ver is None:
             unresolved.append(mod)
             continue
         reqs[normalize_dist_name(chosen)] = ver
@@ -236,7 +542,12 @@ def normalize_dist_name(name: str) -> str:
     return name.replace("_", "-")
 
 
-def pick_best_dist_for_module(mod: str, dists: List[str]) -> str:
+def dist_key(name: str) -> str:
+    # Full PEP 503 normalization; only used as a lookup key
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def pick_best_dist_for_module(mod: str, dists: Sequence[str]) -> str:
     """
     Heuristic to pick a reasonable distribution for a top-level 'mod'.
     """
@@ -262,20 +573,23 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="Generate requirements.txt from imports.")
     parser.add_argument("--root", default=".", help="Project root to scan (default: current folder).")
     parser.add_argument("--out", default="requirements.txt", help="Output file path.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"Don't read or write the per-file import cache ({CACHE_FILE}).")
     args = parser.parse_args()
 
     project_root = Path(args.root).resolve()
     stdlib_dir = get_stdlib_dir()
     site_dirs = get_site_package_dirs()
 
-    py_files = find_python_files(project_root)
-    if not py_files:
+    cache_path = project_root / CACHE_FILE
+    cache = {} if args.no_cache else load_import_cache(cache_path)
+    # The walk is streamed straight into the parser rather than listed up front
+    all_imports, cache_entries, n_files = collect_imports(find_python_files(project_root), cache)
+    if not n_files:
         print(f"[INFO] No Python files found under: {project_root}")
         sys.exit(0)
-
-    all_imports: Set[str] = set()
-    for f in py_files:
-        all_imports |= extract_top_level_imports(f)
+    if not args.no_cache:
+        save_import_cache(cache_path, cache_entries)
 
     third_party_mods: Set[str] = set()
     skipped_local: Set[str] = set()